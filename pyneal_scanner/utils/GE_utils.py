@@ -10,6 +10,7 @@ import logging
 import json
 from threading import Thread
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pydicom
@@ -23,6 +24,31 @@ GE_default_baseDir = '/export/home1/sdc_image_pool/images'
 # regEx for GE style file naming
 GE_filePattern = re.compile(r'i\d*.MRDC.\d*')
 
+# most recent findSessionDir result for each baseDir, stored along with the
+# baseDir mtime and the time window (in seconds) it was found in
+_sessionDir_cache = {}
+_sessionDir_cacheTTL = 5
+
+
+def clearSessionDirCache():
+    """ Forget all cached findSessionDir results, so the next lookup for
+    every baseDir searches the directories again """
+    _sessionDir_cache.clear()
+
+
+# number of subdirs above which _findAllSubdirs stats them in a thread pool
+_parallelStat_minDirs = 32
+_parallelStat_workers = 8
+
+
+def _statOrNone(entry):
+    """ stat a DirEntry, returning None if it can no longer be read (e.g. the
+    dir was deleted after it was listed) """
+    try:
+        return entry.stat()
+    except OSError:
+        return None
+
 
 class GE_DirStructure():
     """ Finding the names and paths of series directories in a GE scanning
@@ -86,27 +112,6 @@ class GE_DirStructure():
         # (hopefully) find and initialize the sessionDir (and subdirs)
         self.findSessionDir()
 
-    def _isSeriesDir(self, dirPath):
-        """ Check path to see if it is a series dir
-        To qualify as a serial dir:
-            - must start with 's'
-            - parent dir must start with 'e'
-            - grandparent dir must start with 'p'
-        """
-        # check the outermost dir
-        ancestors, lastDir = os.path.split(dirPath)
-        if lastDir[0] != 's': return False
-        
-        # check the parent dir
-        ancestors, parentDir = os.path.split(ancestors)
-        if parentDir[0] != 'e': return False 
-        
-        # check the grandparent dir
-        ancestors, gParentDir = os.path.split(ancestors)
-        if gParentDir[0] != 'p': return False 
-
-        return True
-    
     def findSessionDir(self):
         """ Find the most recently modified s### directory. This directory is expected
         to exists 2 levels down (p###/e####) from the self.baseDir 
@@ -117,31 +122,46 @@ class GE_DirStructure():
             eDir
             sessionDir
         """
+        # reuse the previous result if the baseDir is unchanged. A dir mtime
+        # only changes when entries directly inside it are added/removed, so
+        # the result also expires every few secs to catch new e###/s### dirs
+        # (and is dropped if the sessionDir has since been deleted)
+        try:
+            cacheKey = (os.stat(self.baseDir).st_mtime_ns,
+                        int(time.time() // _sessionDir_cacheTTL))
+        except OSError:
+            cacheKey = None
+        cached = _sessionDir_cache.get(self.baseDir)
+        if (cacheKey is not None and cached is not None and cached[0] == cacheKey
+                and os.path.isdir(cached[1][2])):
+            self.pDir, self.eDir, self.sessionDir = cached[1]
+            return
+
         try:
-            # get a list of ALL series dirs
-            seriesDirs = []
-            for root, dirs, files in os.walk(self.baseDir):
-                if self._isSeriesDir(root):
-                    seriesDirs.append(root)
-
-            # get the modification time for each dir
-            seriesDirs = [[path, os.stat(path).st_mtime] for path in seriesDirs]
-
-            # sort to get the most recently created first
-            seriesDirs = sorted(seriesDirs, key=lambda x: x[1], reverse=True)
-            newest_sDir = seriesDirs[0][0]
-
-            # set the sessionDir based on path to parent dir of newest sDir
-            sessionDir = os.path.split(newest_sDir)[0]
-            pTmp, eDir = os.path.split(sessionDir)
-            pTmp, pDir = os.path.split(pTmp)
-
-        except:
-            print('Error: Failed to find a sessionDir \n\n')
-            sessionDir = None
-            pDir = None
-            eDir = None
-        
+            # go through ALL series dirs, matching the p###/e###/s### prefix
+            # at each level as the directories are read. Below the baseDir,
+            # skip any dirs that can't be read (as os.walk would)
+            seriesDirs = (sDir
+                          for pDir in self._findAllSubdirs(self.baseDir, prefix='p') or []
+                          for eDir in self._findReadableSubdirs(pDir[0], prefix='e')
+                          for sDir in self._findReadableSubdirs(eDir[0], prefix='s'))
+
+            # take the most recently modified dir
+            newest_sDir, _ = max(seriesDirs, key=lambda x: x[1], default=(None, 0))
+            if newest_sDir is None:
+                raise FileNotFoundError('no p###/e###/s### dirs in {}'.format(self.baseDir))
+        except OSError as exc:
+            self._sessionDirNotFound(exc)
+            return
+
+        # set the sessionDir based on path to parent dir of newest sDir
+        sessionDir = os.path.split(newest_sDir)[0]
+        pTmp, eDir = os.path.split(sessionDir)
+        pTmp, pDir = os.path.split(pTmp)
+
+        if cacheKey is not None:
+            _sessionDir_cache[self.baseDir] = (cacheKey, (pDir, eDir, sessionDir))
+
         # set values to these attributes
         self.pDir = pDir
         self.eDir = eDir
@@ -156,54 +176,43 @@ class GE_DirStructure():
             sessionDir
         """
         try:
-            # Find the most recent p### dir
-            try:
-                # Find all subdirectores in the baseDir
-                pDirs = self._findAllSubdirs(self.baseDir)
-
-                # remove any dirs that don't start with p
-                pDirs = [x for x in pDirs if os.path.split(x[0])[-1][0] == 'p']
-
-                # sort based on modification time, take the most recent
-                pDirs = sorted(pDirs, key=lambda x: x[1], reverse=True)
-                newest_pDir = pDirs[0][0]
-
-                # just the p### portion
-                pDir = os.path.split(newest_pDir)[-1]
-
-            except:
-                print('Error: Could not find any p### dirs in {} \n\n'.format(self.baseDir))
-
-            # Find the most recent e### dir
-            try:
-                # find all subdirectories in the most recent p### dir
-                eDirs = self._findAllSubdirs(newest_pDir)
-
-                # remove any dirs that don't start with e
-                eDirs = [x for x in eDirs if os.path.split(x[0])[-1][0] == 'e']
-
-                # sort based on modification time, take the most recent
-                eDirs = sorted(eDirs, key=lambda x: x[1], reverse=True)
-                newest_eDir = eDirs[0][0]
-
-                # just the e### portion
-                eDir = os.path.split(newest_eDir)[-1]
+            # Find all p### subdirectories in the baseDir, take the most
+            # recently modified
+            pDirs = self._findAllSubdirs(self.baseDir, prefix='p')
+            newest_pDir, _ = max(pDirs or [], key=lambda x: x[1], default=(None, 0))
+            if newest_pDir is None:
+                raise FileNotFoundError('no p### dirs in {}'.format(self.baseDir))
+
+            # find all e### subdirectories in the most recent p### dir, take
+            # the most recently modified
+            eDirs = self._findAllSubdirs(newest_pDir, prefix='e')
+            newest_eDir, _ = max(eDirs or [], key=lambda x: x[1], default=(None, 0))
+            if newest_eDir is None:
+                raise FileNotFoundError('no e### dirs in {}'.format(newest_pDir))
+        except OSError as exc:
+            self._sessionDirNotFound(exc)
+            return
+
+        # set values to these attributes; just the p### and e### portions, and
+        # the session dir as the full path including the eDir
+        self.pDir = os.path.basename(newest_pDir)
+        self.eDir = os.path.basename(newest_eDir)
+        self.sessionDir = newest_eDir
+
+    def _sessionDirNotFound(self, exc):
+        """ Report a failed sessionDir search, and reset the class attributes
+        for the current session
 
-            except:
-                print('Error: Could not find an e### dirs in {} \n\n'.format(newest_pDir))
-
-            # set the session dir as the full path including the eDir
-            sessionDir = newest_eDir
-        except:
-            print('Error: Failed to find a sessionDir \n\n')
-            sessionDir = None
-            pDir = None
-            eDir = None
+        Parameters
+        ----------
+        exc : OSError
+            the error raised while searching for the sessionDir
 
-        # set values to these attributes
-        self.pDir = pDir
-        self.eDir = eDir
-        self.sessionDir = sessionDir
+        """
+        print('Error: Failed to find a sessionDir: {} \n\n'.format(exc))
+        self.pDir = None
+        self.eDir = None
+        self.sessionDir = None
 
     def print_currentSeries(self):
         """ Find all of the series dirs in current sessionDir, and print them
@@ -229,10 +238,12 @@ class GE_DirStructure():
             currentTime = int(time.time())
             for s in seriesDirs:
                 # get the info from this series dir
-                dirName = s[0].split('/')[-1]
+                dirName = os.path.basename(s[0])
 
-                # calculate & format directory size
-                dirSize = sum([os.path.getsize(join(s[0], f)) for f in os.listdir(s[0])])
+                # calculate & format directory size (one directory read,
+                # reusing each entry for its size)
+                with os.scandir(s[0]) as it:
+                    dirSize = sum(e.stat().st_size for e in it)
                 if dirSize < 1000:
                     size_string = '{:5.1f} bytes'.format(dirSize)
                 elif 1000 <= dirSize < 1000000:
@@ -248,7 +259,17 @@ class GE_DirStructure():
 
                 print('    {}\t{}\t{}'.format(dirName, size_string, time_string))
 
-    def _findAllSubdirs(self, parentDir):
+    def _findReadableSubdirs(self, parentDir, prefix=''):
+        """ Same as _findAllSubdirs, but returns an empty list (rather than
+        raising an error) if the parentDir can't be read
+
+        """
+        try:
+            return self._findAllSubdirs(parentDir, prefix=prefix) or []
+        except OSError:
+            return []
+
+    def _findAllSubdirs(self, parentDir, prefix=''):
         """ Return a list of all subdirectories within the specified
         parentDir, along with the modification time for each
 
@@ -256,23 +277,41 @@ class GE_DirStructure():
         ----------
         parentDir : string
             full path to the parent directory you want to search
+        prefix : string, optional
+            only include subdirectories whose name starts with this prefix
+            (e.g. 'p', 'e', or 's'). Default includes all subdirectories
 
         Returns
         -------
         subDirs : list
-            each item in `subDirs` is itself a list containing 2-items for each
-            subdirectory in the `parentDir`. Each nested list will contain the
+            each item in `subDirs` is a tuple containing 2-items for each
+            subdirectory in the `parentDir`. Each tuple will contain the
             path to the subdirectory and the last modification time for that
             directory. Thus, `subDirs` is structured like:
-                [[subDir_path, subDir_modTime]]
+                [(subDir_path, subDir_modTime)]
 
         """
-        subDirs = [join(parentDir, d) for d in os.listdir(parentDir) if os.path.isdir(join(parentDir, d))]
+        # single pass over the directory; each entry carries its own type,
+        # so no separate isdir calls are needed
+        with os.scandir(parentDir) as it:
+            entries = [e for e in it
+                       if e.name.startswith(prefix) and e.is_dir(follow_symlinks=False)]
+
+        # Use DirEntry.stat() rather than os.stat(path): the entry caches its
+        # stat result (and on Windows gets it for free from the listing), so
+        # each dir costs at most one stat call. For a network-mounted baseDir
+        # this is what matters most: one readdir per dir vs. N+1 round-trips.
+        # Those stat calls are still latency bound there, so overlap them
+        # in a thread pool when there are many dirs to get mod times for
+        if len(entries) > _parallelStat_minDirs:
+            with ThreadPoolExecutor(max_workers=_parallelStat_workers) as pool:
+                stats = list(pool.map(_statOrNone, entries))
+        else:
+            stats = [_statOrNone(e) for e in entries]
+        subDirs = [(e.path, st.st_mtime) for e, st in zip(entries, stats)
+                   if st is not None]
         if not subDirs:
             subDirs = None
-        else:
-            # add the modify time for each directory
-            subDirs = [[path, os.stat(path).st_mtime] for path in subDirs]
 
         # return the subdirectories
         return subDirs
@@ -299,13 +338,14 @@ class GE_DirStructure():
         keepWaiting = True
         while keepWaiting:
             # obtain a list of all directories in sessionDir
-            childDirs = [join(self.sessionDir, d) for d in os.listdir(self.sessionDir) if os.path.isdir(join(self.sessionDir, d))]
+            with os.scandir(self.sessionDir) as it:
+                childDirs = [e for e in it if e.is_dir()]
 
             # loop through all dirs, check modification time
             for thisDir in childDirs:
-                thisDir_mTime = os.path.getmtime(thisDir)
+                thisDir_mTime = thisDir.stat().st_mtime
                 if thisDir_mTime > startTime:
-                    seriesDir = thisDir
+                    seriesDir = thisDir.path
                     keepWaiting = False
                     break
 
@@ -327,15 +367,12 @@ class GE_DirStructure():
             the current `sessionDir`
 
         """
-        # get a list of all sub dirs in the sessionDir
-        subDirs = self._findAllSubdirs(self.sessionDir)
-
-        if subDirs is not None:
-            # extract just the dirname from subDirs and append to a list
-            self.seriesDirs = []
-            for d in subDirs:
-                self.seriesDirs.append(d[0].split('/')[-1])
-        else:
+        # get the names of all sub dirs in the sessionDir. Only the names are
+        # needed, so take them straight from the dir entries (no stat calls)
+        with os.scandir(self.sessionDir) as it:
+            self.seriesDirs = [e.name for e in it if e.is_dir(follow_symlinks=False)]
+
+        if not self.seriesDirs:
             self.seriesDirs = None
 
         return self.seriesDirs
@@ -22,9 +22,16 @@ files for different experiments.
 import os
 from os.path import join
 import sys
-import re
+import stat
+from functools import lru_cache
+from types import MappingProxyType
 
 import yaml
+# use the libyaml-backed loader/dumper when available
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
 
 from kivy.app import App
 from kivy.base import EventLoop
@@ -39,34 +46,89 @@ from kivy.config import Config
 Config.set('graphics', 'width', '400')
 Config.set('graphics', 'height', '800')
 
+# directory containing this GUI (and its images)
+_setupGUI_dir = os.path.dirname(os.path.abspath(__file__))
+
 # initialize global var that will store path to the setupConfigFile
 setupConfigFile = None
 
 submitButtonPressed = False
 
+# set up defaults. Store the value and the dtype. This is used
+# to confirm that a loaded setting is valid. Read-only, since it is shared by
+# every readSettings call
+defaultSettings = MappingProxyType({
+    'pynealHost': ('127.0.0.1', str),
+    'pynealScannerPort': (999, int),
+    'resultsServerPort': (999, int),
+    'maskFile': ('None', str),
+    'maskIsWeighted': (True, bool),
+    'numTimepts': (999, int),
+    'analysisChoice': ('Average', str),
+    'outputPath': ('', str),
+    'launchDashboard': (True, bool),
+    'dashboardPort': (5557, int),
+    'dashboardClientPort': (5558, int)})
+
+# flattened (setting, default value, dtype) view of the defaults, used to
+# validate loaded settings in a single pass
+_settingsSchema = tuple((k, v, dtype) for k, (v, dtype) in defaultSettings.items())
+
+# settings entered via text inputs in the GUI that must be integers
+_intSettings = ('pynealScannerPort', 'resultsServerPort', 'numTimepts')
+
+# just the default value for each setting
+_defaultValues = {k: v for k, (v, dtype) in defaultSettings.items()}
+
+# sentinel for settings that are missing from a loaded file
+_missing = object()
+
+
+@lru_cache(maxsize=8)
+def _loadSettingsFile(settingsFile, mTime, size):
+    """ Load all settings from a yaml file into a dict
+
+    Results are cached, so reloading an unchanged file skips the disk read and
+    yaml parse. `mTime` and `size` are the file's modification time (in ns)
+    and size (in bytes); they are only used as part of the cache key, so that
+    edits to the file are picked up. (The size catches edits made within the
+    same timestamp tick, on filesystems with coarse mtimes.) Callers must not
+    modify the returned dict
+
+    """
+    with open(settingsFile, 'r') as ymlFile:
+        return yaml.load(ymlFile, Loader=_Loader)
+
 
 class SectionHeading(BoxLayout):
     textWidth = NumericProperty()
     labelText = StringProperty('test')
 
 
+class _KeepCharsTable(dict):
+    """ str.translate table that deletes every character not in `keepChars` """
+    def __init__(self, keepChars):
+        super().__init__((ord(c), ord(c)) for c in keepChars)
+
+    def __missing__(self, key):
+        return None
+
+
 class NumberInputField(TextInput):
     # restrict the number fields to 0-9 input only
-    pat = re.compile('[^0-9]')
+    keepChars = _KeepCharsTable('0123456789')
 
     def insert_text(self, substring, from_undo=False):
-        pat = self.pat
-        s = re.sub(pat, '', substring)
+        s = substring.translate(self.keepChars)
         return super().insert_text(s, from_undo=from_undo)
 
 
 class IP_inputField(TextInput):
     # restrict the text input to 0-9, and '.' only
-    pat = re.compile('[^0-9.]')
+    keepChars = _KeepCharsTable('0123456789.')
 
     def insert_text(self, substring, from_undo=False):
-        pat = self.pat
-        s = re.sub(pat, '', substring)
+        s = substring.translate(self.keepChars)
         return super().insert_text(s, from_undo=from_undo)
 
 
@@ -82,7 +144,7 @@ class ModifyPathDialog(BoxLayout):
     to open up a file browser to select a new file/dir using that method
 
     """
-    setupGUI_dir = os.path.dirname(os.path.abspath(__file__))
+    setupGUI_dir = _setupGUI_dir
     # var to store the current path (string)
     currentPath = StringProperty()
 
@@ -165,13 +227,20 @@ class MainContainer(BoxLayout):
     # create a kivy DictProperty that will store a dictionary with all of the
     # settings for the GUI.
     GUI_settings = DictProperty({}, rebind=True)
-    setupGUI_dir = os.path.dirname(os.path.abspath(__file__))
-    print(setupGUI_dir)
+    setupGUI_dir = _setupGUI_dir
     textColor = ListProperty([0, 0, 0, 1])
     analysisInfo = StringProperty('')
 
     def __init__(self, **kwargs):
-        self.GUI_settings = self.readSettings(setupConfigFile)
+        # last path that passed each path check in check_GUI_settings
+        self._validPaths = {}
+
+        try:
+            self.GUI_settings = self.readSettings(setupConfigFile)
+        except ValueError as exc:
+            # can't start the GUI without valid settings; report and quit
+            print(exc)
+            sys.exit()
 
         self.setAnalysisInfo()
 
@@ -192,58 +261,64 @@ class MainContainer(BoxLayout):
             full path to the settings yaml file that contains one or more of
             the settings to be used for creating the mask
 
-        """
-        # set up defaults. Store the value and the dtype. This is used
-        # to confirm that a loaded setting is valid
-        defaultSettings = {
-            'pynealHost': ['127.0.0.1', str],
-            'pynealScannerPort': [999, int],
-            'resultsServerPort': [999, int],
-            'maskFile': ['None', str],
-            'maskIsWeighted': [True, bool],
-            'numTimepts': [999, int],
-            'analysisChoice': ['Average', str],
-            'outputPath': ['', str],
-            'launchDashboard': [True, bool],
-            'dashboardPort': [5557, int],
-            'dashboardClientPort': [5558, int]}
+        Returns
+        -------
+        newSettings : dict
+            all settings, taken from the `settingsFile` where available and
+            from the defaults otherwise
 
+        Raises
+        ------
+        ValueError
+            if any setting in the `settingsFile` has the wrong dtype. The
+            message lists every invalid setting
+
+        """
         # initialize dictionary that will eventually hold the new settings
         newSettings = {}
+        errors = []
 
-        # load the settingsFile, if it exists and is not empty
-        if os.path.isfile(settingsFile) and os.path.getsize(settingsFile) > 0:
-            # open the file, load all settings from the file into a dict
-            with open(settingsFile, 'r') as ymlFile:
-                loadedSettings = yaml.load(ymlFile)
+        # load the settingsFile, if it exists and is not empty (a single
+        # stat call covers both checks, plus the mtime for the cache)
+        try:
+            fileStat = os.stat(settingsFile)
+            haveSettingsFile = stat.S_ISREG(fileStat.st_mode) and fileStat.st_size > 0
+        except OSError:
+            haveSettingsFile = False
+
+        if haveSettingsFile:
+            # load all settings from the file into a dict
+            loadedSettings = _loadSettingsFile(settingsFile, fileStat.st_mtime_ns,
+                                               fileStat.st_size)
 
             # Go through all default settings, and see if there is
             # a loaded setting that should overwrite the default
-            for k in defaultSettings.keys():
-                # does this key exist in the loaded settings
-                if k in loadedSettings.keys():
-                    loadedValue = loadedSettings[k]
-
-                    # does the dtype of the value match what is
-                    # specifed by the default?
-                    if type(loadedValue) == defaultSettings[k][1]:
-                        newSettings[k] = loadedValue
-                    else:
-                        # throw error and quit
-                        print('Problem loading the settings file!')
-                        print('{} setting expecting dtype {}, but got {}'.format(
-                              k,
-                              defaultSettings[k][1],
-                              type(loadedValue)))
-                        sys.exit()
+            for k, default, dtype in _settingsSchema:
+                loadedValue = loadedSettings.get(k, _missing)
+
                 # if the loaded file doesn't have this setting, take the default
+                if loadedValue is _missing:
+                    newSettings[k] = default
+
+                # does the dtype of the value match what is specifed by the
+                # default? (bool is a subclass of int, so never accept a bool
+                # for a non-bool setting)
+                elif isinstance(loadedValue, dtype) and (dtype is bool or not isinstance(loadedValue, bool)):
+                    newSettings[k] = loadedValue
                 else:
-                    newSettings[k] = defaultSettings[k][0]
+                    errors.append('{}: expected {}, got {}'.format(
+                                  k,
+                                  dtype.__name__,
+                                  type(loadedValue).__name__))
+
+            if errors:
+                raise ValueError('Problem loading the settings file {}!\n{}'.format(
+                                 settingsFile,
+                                 '\n'.join(errors)))
 
         # if no settings file exists, use the defaults
         else:
-            for k in defaultSettings.keys():
-                newSettings[k] = defaultSettings[k][0]
+            newSettings = _defaultValues.copy()
 
         # return the settings dict
         return newSettings
@@ -286,37 +361,74 @@ class MainContainer(BoxLayout):
     def check_GUI_settings(self):
         """ Check the validity of all current GUI settings
 
+        The settings are converted to their final types along the way, so
+        they only need to be walked once
+
         Returns
         -------
-        errorCheckPassed : Boolean
-            True/False flag indicating whether ALL of the current settings are
-            valid or not
+        allSettings : dict or None
+            regular python dict with all of the current settings (text inputs
+            converted to integers) if ALL of the current settings are valid;
+            None otherwise
 
         """
+        # Convert the GUI_settings from kivy dictproperty to a regular ol'
+        # python dict (and do some reformatting along the way)
+        allSettings = dict(self.GUI_settings)
         errorMsg = []
+
         # check if text inputs are valid integers
-        for k in ['pynealScannerPort', 'resultsServerPort', 'numTimepts']:
+        for k in _intSettings:
             try:
-                tmp = int(self.GUI_settings[k])
-            except:
+                allSettings[k] = int(allSettings[k])
+            except (TypeError, ValueError):
                 errorMsg.append('{}: not an integer'.format(k))
-                pass
 
         # check if maskFile is a valid path
-        if not os.path.isfile(self.GUI_settings['maskFile']):
-            errorMsg.append('{} is not a valid mask file'.format(self.GUI_settings['maskFile']))
+        if not self.checkPath('maskFile', allSettings['maskFile'], os.path.isfile):
+            errorMsg.append('{} is not a valid mask file'.format(allSettings['maskFile']))
 
         # check if output path is a valid path
-        if not os.path.isdir(self.GUI_settings['outputPath']):
-            errorMsg.append('{} is not a valid output path'.format(self.GUI_settings['outputPath']))
+        if not self.checkPath('outputPath', allSettings['outputPath'], os.path.isdir):
+            errorMsg.append('{} is not a valid output path'.format(allSettings['outputPath']))
 
         # show the error notification, if any
         if len(errorMsg) > 0:
             self.show_ErrorNotification('\n\n'.join(errorMsg))
-            errorCheckPassed = False
-        else:
-            errorCheckPassed = True
-        return errorCheckPassed
+            return None
+        return allSettings
+
+    def checkPath(self, setting, path, check):
+        """ Check whether the path for a given setting is valid
+
+        Paths that passed the check last time are not checked again, which
+        saves repeated (and potentially slow, on network mounts) filesystem
+        calls on each submit. Failed paths are always re-checked, so fixing a
+        path outside of the GUI is picked up
+
+        Parameters
+        ----------
+        setting : string
+            name of the setting the path belongs to (e.g. 'maskFile')
+        path : string
+            path to check
+        check : function
+            function that takes `path` and returns True if it is valid
+            (e.g. os.path.isfile)
+
+        Returns
+        -------
+        isValid : Boolean
+            True/False flag indicating whether the path is valid
+
+        """
+        if self._validPaths.get(setting) == path:
+            return True
+
+        isValid = check(path)
+        if isValid:
+            self._validPaths[setting] = path
+        return isValid
 
     def submitGUI(self):
         """ Submit the GUI
@@ -325,23 +437,13 @@ class MainContainer(BoxLayout):
 
         """
         ## Error Check All GUI SETTINGS
-        errorCheckPassed = self.check_GUI_settings()
+        allSettings = self.check_GUI_settings()
 
         # write GUI settings to file
-        if errorCheckPassed:
-            # Convery the GUI_settings from kivy dictproperty to a regular ol'
-            # python dict (and do some reformatting along the way)
-            allSettings = {}
-            for k in self.GUI_settings.keys():
-                # convert text inputs to integers
-                if k in ['pynealScannerPort', 'resultsServerPort', 'numTimepts']:
-                        allSettings[k] = int(self.GUI_settings[k])
-                else:
-                    allSettings[k] = self.GUI_settings[k]
-
+        if allSettings is not None:
             # write the settings as the new config yaml file
             with open(setupConfigFile, 'w') as outputFile:
-                yaml.dump(allSettings, outputFile, default_flow_style=False)
+                yaml.dump(allSettings, outputFile, Dumper=_Dumper, default_flow_style=False)
 
             # Close the GUI
             global submitButtonPressed
@@ -404,7 +506,11 @@ class MainContainer(BoxLayout):
         if len(selection) > 0:
             # read the settings file, load new settings into GUI
             settingsFile = selection[0]
-            self.GUI_settings = self.readSettings(settingsFile)
+            try:
+                self.GUI_settings = self.readSettings(settingsFile)
+            except ValueError as exc:
+                # keep the current settings, and tell the user why
+                self.show_ErrorNotification(str(exc))
 
         # close  dialog
         self.closeFileBrowser()
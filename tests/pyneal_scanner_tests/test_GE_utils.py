@@ -20,6 +20,21 @@ import pyneal_scanner.utils.GE_utils as GE_utils
 import pyneal_scanner.utils.general_utils as general_utils
 
 
+class FakeScannerSettings():
+    """ Stand-in for general_utils.ScannerSettings, pointing at a baseDir """
+    def __init__(self, baseDir):
+        self.allSettings = {'scannerBaseDir': str(baseDir)}
+
+
+def makeSeriesDir(baseDir, seriesPath, mTime):
+    """ Create the p###/e###/s### dir at seriesPath within baseDir, with the
+    given modification time """
+    seriesDir = join(str(baseDir), seriesPath)
+    os.makedirs(seriesDir)
+    os.utime(seriesDir, (mTime, mTime))
+    return seriesDir
+
+
 ### Tests for classses/functions within the GE_utils.py module.
 class Test_GE_utils():
     def test_GE_DirStructure(self):
@@ -59,6 +74,95 @@ class Test_GE_utils():
         # remove local paths from config file
         helper_tools.cleanConfigFile(configFile)
 
+    def test_GE_DirStructure_sessionDirCache(self, tmp_path, monkeypatch):
+        """ test the cached results of GE_utils.GE_DirStructure.findSessionDir """
+        # keep the cache from expiring partway through the test
+        monkeypatch.setattr(GE_utils, '_sessionDir_cacheTTL', 1e9)
+        GE_utils.clearSessionDirCache()
+
+        makeSeriesDir(tmp_path, 'p1/e1/s1', 1000)
+        scannerDirs = GE_utils.GE_DirStructure(FakeScannerSettings(tmp_path))
+        assert scannerDirs.get_sessionDir() == join(str(tmp_path), 'p1/e1')
+
+        # a newer series in an existing p### dir leaves the baseDir unchanged,
+        # so a repeat lookup is served from the cache
+        makeSeriesDir(tmp_path, 'p1/e2/s2', 2000)
+        scannerDirs.findSessionDir()
+        assert scannerDirs.get_sessionDir() == join(str(tmp_path), 'p1/e1')
+
+        # ...until the cache is cleared
+        GE_utils.clearSessionDirCache()
+        scannerDirs.findSessionDir()
+        assert scannerDirs.get_sessionDir() == join(str(tmp_path), 'p1/e2')
+
+        # a new p### dir changes the baseDir mtime, which invalidates the cache
+        makeSeriesDir(tmp_path, 'p2/e3/s3', 3000)
+        os.utime(str(tmp_path), (4000, 4000))
+        scannerDirs.findSessionDir()
+        assert scannerDirs.get_pDir() == 'p2'
+        assert scannerDirs.get_sessionDir() == join(str(tmp_path), 'p2/e3')
+
+        # a cached sessionDir that has been deleted isn't handed back
+        shutil.rmtree(join(str(tmp_path), 'p2/e3'))
+        scannerDirs.findSessionDir()
+        assert scannerDirs.get_sessionDir() == join(str(tmp_path), 'p1/e2')
+
+        GE_utils.clearSessionDirCache()
+
+    def test_GE_DirStructure_unreadableDirs(self, tmp_path, monkeypatch):
+        """ test that GE_utils.GE_DirStructure.findSessionDir skips dirs it
+        can't read, rather than failing the whole search """
+        GE_utils.clearSessionDirCache()
+        makeSeriesDir(tmp_path, 'p1/e1/s1', 1000)
+        makeSeriesDir(tmp_path, 'p1/e2/s2', 2000)
+        makeSeriesDir(tmp_path, 'p2/e3/s3', 3000)
+
+        # make p2/e3 unreadable (chmod isn't enough when running as root)
+        realScandir = os.scandir
+        unreadableDir = join(str(tmp_path), 'p2', 'e3')
+
+        def fakeScandir(path):
+            if path == unreadableDir:
+                raise PermissionError(13, 'Permission denied', path)
+            return realScandir(path)
+        monkeypatch.setattr(GE_utils.os, 'scandir', fakeScandir)
+
+        scannerDirs = GE_utils.GE_DirStructure(FakeScannerSettings(tmp_path))
+        assert scannerDirs.get_sessionDir() == join(str(tmp_path), 'p1/e2')
+
+        # same for a dir that's deleted between listing it and stat'ing it
+        realStatOrNone = GE_utils._statOrNone
+
+        def fakeStatOrNone(entry):
+            if entry.name == 'e2':
+                shutil.rmtree(entry.path)
+            return realStatOrNone(entry)
+        monkeypatch.setattr(GE_utils, '_statOrNone', fakeStatOrNone)
+
+        GE_utils.clearSessionDirCache()
+        scannerDirs.findSessionDir()
+        assert scannerDirs.get_sessionDir() == join(str(tmp_path), 'p1/e1')
+
+        GE_utils.clearSessionDirCache()
+
+    def test_GE_DirStructure_manySubdirs(self, tmp_path):
+        """ test GE_utils.GE_DirStructure with enough series dirs that their
+        mod times are read in a thread pool """
+        GE_utils.clearSessionDirCache()
+        nSeries = GE_utils._parallelStat_minDirs + 8
+        for i in range(nSeries):
+            makeSeriesDir(tmp_path, 'p1/e1/s{}'.format(i), 1000 + i)
+
+        scannerDirs = GE_utils.GE_DirStructure(FakeScannerSettings(tmp_path))
+        assert scannerDirs.get_sessionDir() == join(str(tmp_path), 'p1/e1')
+
+        subDirs = scannerDirs._findAllSubdirs(scannerDirs.get_sessionDir())
+        assert len(subDirs) == nSeries
+        for path, mTime in subDirs:
+            assert mTime == 1000 + int(os.path.basename(path)[1:])
+
+        GE_utils.clearSessionDirCache()
+
     def test_GE_BuildNifti(self):
         """ Note: this module is already tested as part of the test_getSeries.py
         suite of tests. This function here is just included for the sake of
@@ -7,6 +7,7 @@ import json
 import importlib
 
 import numpy as np
+import pytest
 
 import pyneal_helper_tools as helper_tools
 
@@ -59,6 +60,21 @@ class Test_launchPynealSim():
             result = resultsServer.requestLookup(volIdx)
             assert result['testResult'] == fakeResults[volIdx]
 
+        # negative vols should be rejected without touching stored results
+        with pytest.raises(ValueError):
+            resultsServer.updateResults(-1, {'testResult': 0})
+        assert resultsServer.requestLookup(2)['testResult'] == fakeResults[2]
+
+        # very high vols shouldn't grow the preallocated lists
+        resultsServer.updateResults(10**9, {'testResult': 0})
+        assert len(resultsServer.results) == 3
+        assert resultsServer.requestLookup(10**9)['testResult'] == 0
+
+        # invalid vols should just have no results
+        for volIdx in ['abc', -1, '']:
+            assert resultsServer.requestLookup(volIdx)['foundResults'] == False
+        assert resultsServer.requestLookup('1')['testResult'] == fakeResults[1]
+
         # test sending a request from a remote socket connection
         requestedVolIdx = 1     # vol that exists
         result = fakeEndUserRequest(requestedVolIdx, port)
@@ -69,9 +85,138 @@ class Test_launchPynealSim():
         result = fakeEndUserRequest(requestedVolIdx, port)
         assert result['foundResults'] == False
 
+        # like real Pyneal, the server should close the connection after
+        # sending the response
+        clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        clientSocket.settimeout(5)
+        clientSocket.connect((host, port))
+        result = sendRequest(clientSocket, 1)
+        assert result['foundResults'] == True
+        assert clientSocket.recv(1) == b''
+        clientSocket.close()
+
         # assuming nothing crashed, close the socket
         resultsServer.killServer()
 
+    def test_pynealResultsSim_persistentConnection(self):
+        """ test pynealResults_sim.ResultsServer
+
+        test sending multiple requests over a single connection
+        """
+        port = 6002
+        # launch the simulated results server
+        settings = {'pynealHost': host, 'resultsServerPort': port,
+                    'extendedProtocol': True}
+        resultsServer = pynealResults_sim.ResultsServer(settings)
+        resultsServer.daemon = True
+        resultsServer.start()
+
+        fakeResults = np.array([5000.1, 5000.2, 5000.3])
+        for volIdx in range(3):
+            thisResult = {'testResult': fakeResults[volIdx]}
+            resultsServer.updateResults(volIdx, thisResult)
+
+        # send requests for vols that do and don't exist on the same socket
+        clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        clientSocket.connect((host, port))
+        for requestedVolIdx in [2, 0, 99]:
+            result = sendRequest(clientSocket, requestedVolIdx)
+            if requestedVolIdx < 3:
+                assert result['foundResults'] == True
+                assert result['testResult'] == fakeResults[requestedVolIdx]
+            else:
+                assert result['foundResults'] == False
+        clientSocket.close()
+
+        # assuming nothing crashed, close the socket
+        resultsServer.killServer()
+
+    def test_pynealResultsSim_rangeRequest(self):
+        """ test pynealResults_sim.ResultsServer
+
+        test requesting a range of volumes in a single request
+        """
+        port = 6003
+        # launch the simulated results server
+        settings = {'pynealHost': host, 'resultsServerPort': port,
+                    'extendedProtocol': True}
+        resultsServer = pynealResults_sim.ResultsServer(settings)
+        resultsServer.daemon = True
+        resultsServer.start()
+
+        fakeResults = np.array([5000.1, 5000.2, 5000.3])
+        for volIdx in range(3):
+            thisResult = {'testResult': fakeResults[volIdx]}
+            resultsServer.updateResults(volIdx, thisResult)
+
+        # request vols 1-4; the last 2 don't exist yet
+        clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        clientSocket.connect((host, port))
+        clientSocket.send('r00010004'.encode())
+        for requestedVolIdx in range(1, 5):
+            result = readResponse(clientSocket)
+            if requestedVolIdx < 3:
+                assert result['foundResults'] == True
+                assert result['testResult'] == fakeResults[requestedVolIdx]
+            else:
+                assert result['foundResults'] == False
+
+        # an inverted range gets a single not found response
+        clientSocket.send('r00020001'.encode())
+        result = readResponse(clientSocket)
+        assert result['foundResults'] == False
+        clientSocket.close()
+
+        # assuming nothing crashed, close the socket
+        resultsServer.killServer()
+
+    def test_pynealResultsSim_killServer(self):
+        """ test pynealResults_sim.ResultsServer
+
+        test that killServer stops the server and frees the port
+        """
+        port = 6004
+        # launch the simulated results server
+        settings = {'pynealHost': host, 'resultsServerPort': port}
+        resultsServer = pynealResults_sim.ResultsServer(settings)
+        resultsServer.daemon = True
+        resultsServer.start()
+
+        # once killed, the server should no longer accept connections
+        resultsServer.killServer()
+        assert not resultsServer.is_alive()
+        clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        with pytest.raises(ConnectionRefusedError):
+            clientSocket.connect((host, port))
+        clientSocket.close()
+
+        # killing it again should be harmless
+        resultsServer.killServer()
+
+    def test_pynealResultsSim_formatMsg(self, monkeypatch):
+        """ test pynealResults_sim.ResultsServer._formatMsg
+
+        test that the orjson and json encoders produce the same response
+        """
+        orjson = pytest.importorskip('orjson')
+        settings = {'pynealHost': host, 'resultsServerPort': 6005}
+        resultsServer = pynealResults_sim.ResultsServer(settings)
+
+        results = {'average': np.float64(2400.12), 1: 'intKey',
+                   'nested': {2: [1, 2.5]}, 'foundResults': True}
+        monkeypatch.setattr(pynealResults_sim, 'orjson', orjson)
+        orjsonMsg = resultsServer._formatMsg(results)
+        monkeypatch.setattr(pynealResults_sim, 'orjson', None)
+        jsonMsg = resultsServer._formatMsg(results)
+
+        orjsonHdr, orjsonBody = orjsonMsg.split(b'\n', 1)
+        jsonHdr, jsonBody = jsonMsg.split(b'\n', 1)
+        assert int(orjsonHdr) == len(orjsonBody)
+        assert int(jsonHdr) == len(jsonBody)
+        assert json.loads(orjsonBody.decode()) == json.loads(jsonBody.decode())
+
+        resultsServer.killServer()
+
 
 def fakeEndUserRequest(requestedVolIdx, port):
     """ Function to mimic the behavior of the end user, which sends a request
@@ -90,11 +235,40 @@ def fakeEndUserRequest(requestedVolIdx, port):
     clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     clientSocket.connect((host, port))
 
+    serverResp = sendRequest(clientSocket, requestedVolIdx)
+    clientSocket.close()
+    return serverResp
+
+
+def sendRequest(clientSocket, requestedVolIdx):
+    """ Send a single request over an open connection to the simulated
+    results server, and read the response
+
+    Parameters
+    ----------
+    clientSocket : socket object
+        socket connected to the results server
+    volIdx : int
+        the volIdx of the volume you'd like to request results for
+
+    """
     # send request for volume number. Request must by 4-char string representing
     # the volume number requested
     request = str(requestedVolIdx).zfill(4)
     clientSocket.send(request.encode())
 
+    return readResponse(clientSocket)
+
+
+def readResponse(clientSocket):
+    """ Read a single response from the simulated results server
+
+    Parameters
+    ----------
+    clientSocket : socket object
+        socket connected to the results server
+
+    """
     # When the results server recieved the request, it will send back a variable
     # length response. But first, it will send a header indicating how long the response
     # is. This is so the socket knows how many bytes to read
@@ -108,8 +282,9 @@ def fakeEndUserRequest(requestedVolIdx, port):
     msgLen = int(hdr)
 
     # now read the full response from the server
-    serverResp = clientSocket.recv(msgLen)
-    clientSocket.close()
+    serverResp = b''
+    while len(serverResp) < msgLen:
+        serverResp += clientSocket.recv(msgLen - len(serverResp))
 
     # format at JSON
     serverResp = json.loads(serverResp.decode())
@@ -16,16 +16,50 @@ Responses from the server will be JSON strings:
     If they don't:
         {'foundResults': False}
 
+As with the real Pyneal results server, the connection is closed after each
+response.
+
+** Extended protocol *******************
+If launched with --extendedProtocol, the simulator also supports the
+following. NOTE: these are NOT supported by the real Pyneal results server,
+so clients relying on them won't work with Pyneal itself:
+    - Clients may keep the connection open after a response, and send further
+    requests over it (the server only closes it once the client does)
+    - Clients can request a range of volumes at once by sending 'r' followed
+    by the first and last volume numbers (inclusive) as 4-character strings.
+    E.g. 'r01000110' for volumes 100 through 110. The server will reply with
+    one response per volume in the range, in order, sent back-to-back
+
 """
 import json
+import logging
+import asyncio
 import atexit
 import socket
-from threading import Thread
+from threading import Thread, current_thread
 import time
 import argparse
 
 import numpy as np
 
+# use the (much faster) orjson encoder if it is installed. The output matches
+# the json module's, except that NaN/Infinity values are sent as null (json
+# would send them as the non-standard NaN/Infinity)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# response for volumes that don't have results (yet)
+notFoundResults = {'foundResults': False}
+
+# requests are 4-digit volume numbers, so only vols below this can ever be
+# requested by clients. Results for these are stored in (preallocated) lists;
+# any beyond it are kept in a dict instead
+maxVols = 10000
+
 
 class ResultsServer(Thread):
     """ Class to serve results from real-time analysis.
@@ -42,24 +76,34 @@ class ResultsServer(Thread):
         settings : dict
             dictionary that has (at least) the following keys:
             -resultsServerPort: port # for results server socket [e.g. 5555]
+            and optionally:
+            -nVols: expected # of volumes, to preallocate the results for
+            -extendedProtocol: whether to support persistent connections
+            and range requests (which real Pyneal doesn't) [default: False]
         """
         # start the thread upon creation
         Thread.__init__(self)
 
         # configuration parameters
         self.alive = True
-        self.results = {}       # store results in dict like {'vol#':{results}}
+        self._notFoundMsg = self._formatMsg(notFoundResults)
+        nVols = min(settings.get('nVols', 0), maxVols)
+        self.results = [notFoundResults] * nVols    # results for each vol, indexed by volIdx
+        self.encodedResults = [self._notFoundMsg] * nVols   # ready-to-send responses, like b'hdr\nmsg'
+        self.extraResults = {}  # results for any vols >= maxVols, like {volIdx:{results}}
         self.host = settings['pynealHost']
         self.resultsServerPort = settings['resultsServerPort']
-        self.maxClients = 1
+        self.extendedProtocol = settings.get('extendedProtocol', False)
+        self.maxClients = 128   # backlog of pending connections
+        self._loop = None       # event loop serving the socket, once running
 
         # launch server
         self.resultsSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.resultsSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.resultsSocket.bind((self.host, self.resultsServerPort))
         self.resultsSocket.listen(self.maxClients)
-        print('Results Server bound to {}:{}'.format(self.host, self.resultsServerPort))
-        print('Results Server alive and listening....')
+        logger.info('Results Server bound to %s:%s', self.host, self.resultsServerPort)
+        logger.info('Results Server alive and listening....')
 
         # atexit function, shut down server
         atexit.register(self.killServer)
@@ -68,46 +112,165 @@ class ResultsServer(Thread):
         """ Run server, listening for requests and returning responses to
         clients
 
+        Runs an asyncio event loop on this thread, so that many client
+        connections can be handled concurrently. Returns once the server is
+        killed
+
         """
-        while self.alive:
-            ### Listen for new connections, redirect clients to new socket
-            try:
-                connection, address = self.resultsSocket.accept()
-                print('Results server received connection from: {}'.format(address))
+        if not self.alive:
+            return
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            server = loop.run_until_complete(
+                asyncio.start_server(self.handleRequest, sock=self.resultsSocket))
+        except OSError:
+            # socket was already closed by killServer
+            loop.close()
+            return
+        self._loop = loop
+
+        # serve until killServer stops the loop (unless it already ran)
+        if self.alive:
+            loop.run_forever()
+
+        # stop accepting connections, and drop any clients still connected
+        server.close()
+        allTasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+        pendingTasks = allTasks(loop)
+        for task in pendingTasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pendingTasks, return_exceptions=True))
+        loop.close()
+
+    async def handleRequest(self, reader, writer):
+        """ Respond to client requests
+
+        Like the real Pyneal results server, closes the connection after
+        responding. With the extended protocol, instead keeps answering
+        requests on the connection until the client closes it, so polling
+        clients can reuse a single connection
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+            stream to read the client request from
+        writer : asyncio.StreamWriter
+            stream to write the response to the client to
 
+        """
+        try:
+            logger.debug('Results server received connection from: %s',
+                         writer.get_extra_info('peername'))
+
+            # bind what the request loop uses to locals, to skip the
+            # attribute lookups on every request. (encodedResults is only
+            # ever updated in place, so this stays current)
+            readexactly = reader.readexactly
+            write = writer.write
+            writelines = writer.writelines
+            drain = writer.drain
+            encodedResults = self.encodedResults
+            notFoundMsg = self._notFoundMsg
+            extendedProtocol = self.extendedProtocol
+
+            while True:
                 ### Get the requested volume (should be a 4-char string representing
                 # volume number, e.g. '0001')
-                recvMsg = connection.recv(4).decode()
-                print('Received request: {}'.format(recvMsg))
+                try:
+                    requestedVol = await readexactly(4)
+                except asyncio.IncompleteReadError as exc:
+                    # client closed the connection; answer anything it sent
+                    # before that (if it's still listening), then stop
+                    requestedVol = exc.partial
+                    if not requestedVol:
+                        break
+                logger.debug('Received request: %s', requestedVol)
+
+                ### Range requests (e.g. 'r01000110') get all of the responses
+                # for the range in a single write
+                if extendedProtocol and requestedVol[:1] == b'r':
+                    try:
+                        rangeRequest = requestedVol + await readexactly(5)
+                    except asyncio.IncompleteReadError:
+                        break
+                    writelines(self._lookupRange(rangeRequest[1:5], rangeRequest[5:]))
+                    await drain()
+                    continue
+
+                ### Look up the (already encoded) results for the requested
+                # volume. Anything that isn't a valid volume index gets the
+                # not found response. Requests are plain ASCII digits, so
+                # check for that up front instead of catching int() errors
+                # (which would also accept e.g. b' +12')
+                volIdx = int(requestedVol) if requestedVol.isdigit() else -1
+                if 0 <= volIdx < len(encodedResults):
+                    formattedMsg = encodedResults[volIdx]
+                else:
+                    formattedMsg = notFoundMsg
 
-                # reformat the requested volume to remove any leading 0s
-                requestedVol = str(int(recvMsg))
+                ### Send the results to the client
+                write(formattedMsg)
+                await drain()
+                logger.debug('Response: %s', formattedMsg)
 
-                ### Look up the results for the requested volume
-                volResults = self.requestLookup(requestedVol)
+                if not extendedProtocol or len(requestedVol) < 4:
+                    break
 
-                ### Send the results to the client
-                self.sendResults(connection, volResults)
-                print('Response: {}'.format(volResults))
+        except ConnectionError:
+            logger.warning('Lost connection to client!')
+
+        except asyncio.CancelledError:
+            pass    # server is shutting down
+
+        finally:
+            # close client connection
+            writer.close()
 
-                # close client connection
-                connection.close()
-                
-            except ConnectionAbortedError:
-                print('Attemping to connect to a closed socket!')
-                return
+    def _lookupRange(self, firstVol, lastVol):
+        """ Look up the encoded responses for a range of volumes
+
+        Parameters
+        ----------
+        firstVol : bytes
+            4-char string representing the first volume in the range
+        lastVol : bytes
+            4-char string representing the last volume in the range (inclusive)
+
+        Returns
+        -------
+        formattedMsgs : list
+            ready-to-send responses for every volume in the range, in order.
+            Volumes without results get the not found response. If the range
+            isn't valid (or the first volume is after the last), this is a
+            single not found response
+
+        """
+        if not (firstVol.isdigit() and lastVol.isdigit()):
+            return [self._notFoundMsg]
+        firstVol, lastVol = int(firstVol), int(lastVol) + 1
+        if firstVol >= lastVol:
+            return [self._notFoundMsg]
+
+        # take everything that's been stored so far, and pad out the rest of
+        # the range with not found responses
+        formattedMsgs = self.encodedResults[firstVol:lastVol]
+        formattedMsgs.extend([self._notFoundMsg] * (lastVol - firstVol - len(formattedMsgs)))
+        return formattedMsgs
 
     def updateResults(self, volIdx, volResults):
         """ Add the supplied result to the results dictionary.
 
-        There is a master dictionary (called `results`) that stores the
-        analysis results for each volume throughout a scan. The keys in this
-        master dictionary will be the volume indices; the values for each key
-        will itself be a (nested) dictionary containing the specific result(s)
-        for that volume.
+        There is a master list (called `results`) that stores the analysis
+        results for each volume throughout a scan, indexed by the volume
+        indices; each entry will itself be a dictionary containing the
+        specific result(s) for that volume.
 
         This function takes the results dictionary for a single volume, and
-        adds it to the master dictionary under a new key (the volIdx).
+        adds it (along with 'foundResults': True) to the master list at the
+        volIdx, growing the list if needed. Volumes too high to ever be
+        requested by a client (see `maxVols`) are stored separately, in the
+        `extraResults` dictionary.
 
         Parameters
         ----------
@@ -117,9 +280,32 @@ class ResultsServer(Thread):
             dictionary containing the result(s) of the analysis for the current
             volume
 
+        Raises
+        ------
+        ValueError
+            if volIdx is negative
+
         """
-        self.results[str(volIdx)] = volResults
-        print('vol {} - {} added to resultsServer'.format(volIdx, volResults))
+        volIdx = int(volIdx)
+        if volIdx < 0:
+            raise ValueError('volIdx must be non-negative, not {}'.format(volIdx))
+
+        # store the results in the final shape of the response (so lookups
+        # never need to modify them), and encode that response now, so that
+        # requests for it can be answered without re-serializing
+        theseResults = {**volResults, 'foundResults': True}
+        if volIdx >= maxVols:
+            self.extraResults[volIdx] = theseResults
+            logger.debug('vol %s - %s added to resultsServer', volIdx, volResults)
+            return
+
+        nNew = volIdx + 1 - len(self.results)
+        if nNew > 0:
+            self.results.extend([notFoundResults] * nNew)
+            self.encodedResults.extend([self._notFoundMsg] * nNew)
+        self.results[volIdx] = theseResults
+        self.encodedResults[volIdx] = self._formatMsg(theseResults)
+        logger.debug('vol %s - %s added to resultsServer', volIdx, volResults)
 
     def requestLookup(self, volIdx):
         """ Lookup results for the requested volume
@@ -132,7 +318,7 @@ class ResultsServer(Thread):
 
         Parameters
         ----------
-        volIdx : int
+        volIdx : int or str
             volume index (0-based) of the volume you are requesting results for
 
         Returns
@@ -143,22 +329,27 @@ class ResultsServer(Thread):
             'foundResults' and the value is True or False based on whether
             there are any results for this volume. If True, the remaining
             items in the dictionary will reflect all of the stored results
-            for the requested volume
+            for the requested volume. This dictionary is shared, and should
+            not be modified
 
         """
-        if str(volIdx) in self.results.keys():
-            theseResults = self.results[str(volIdx)]
-            theseResults['foundResults'] = True
-        else:
-            theseResults = {'foundResults': False}
-        return theseResults
+        # anything that isn't a valid (non-negative) volume index has no
+        # results, same as for requests over the socket
+        volIdx = str(volIdx)
+        if not volIdx.isdigit():
+            return notFoundResults
+        volIdx = int(volIdx)
+        if volIdx < len(self.results):
+            return self.results[volIdx]
+        return self.extraResults.get(volIdx, notFoundResults)
 
     def sendResults(self, connection, results):
         """ Send the results back to the End User
 
         Format the results dict to a json string, and send results to the End
-        User. Message will be sent in 2 waves: first a header indicating the
-        msg length, and then the message itself.
+        User. Message will be made up of 2 parts: first a header indicating the
+        msg length, and then the message itself. Both parts are sent together
+        in a single write.
 
         The size of results messages can vary substantially based on the
         specific analyses performed, and whether or not the the results were
@@ -174,24 +365,63 @@ class ResultsServer(Thread):
             dictionary containing the results to be sent to the End User
 
         """
-        # format as json string and then convert to bytes
-        formattedMsg = json.dumps(results).encode()
+        formattedMsg = self._formatMsg(results)
+        connection.sendall(formattedMsg)
+        logger.debug('Sent result: %s', formattedMsg)
 
-        # build then send header with info about msg length
-        hdr = '{:d}\n'.format(len(formattedMsg))
-        connection.send(hdr.encode())
+    def _formatMsg(self, results):
+        """ Format a results dict as a message for the End User
 
-        # send results as formatted message
-        connection.sendall(formattedMsg)
-        print('Sent result: {}'.format(formattedMsg))
+        Parameters
+        ----------
+        results : dict
+            dictionary containing the results to be sent to the End User
+
+        Returns
+        -------
+        formattedMsg : bytes
+            header indicating the msg length, followed by the results as a
+            json string
+
+        """
+        # format as json string as bytes. orjson handles numpy values directly,
+        # and (like json) converts non-str keys to strings
+        if orjson is not None:
+            msg = orjson.dumps(results, option=orjson.OPT_SERIALIZE_NUMPY
+                               | orjson.OPT_NON_STR_KEYS)
+        else:
+            msg = json.dumps(results).encode()
+
+        # prepend header with info about msg length
+        return b'%d\n%s' % (len(msg), msg)
 
     def killServer(self):
-        """ Close the thread by setting the alive flag to False """
+        """ Close the thread by setting the alive flag to False, stopping
+        the event loop serving requests, and closing the server socket.
+
+        Waits (briefly) for the server thread to finish, so the port is free
+        again once this returns. Safe to call more than once, or before the
+        server was started
+        """
         self.alive = False
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(loop.stop)
+            except RuntimeError:
+                pass    # loop already closed
+
+        # wait for the server thread to shut the loop down
+        if self.is_alive() and self is not current_thread():
+            self.join(timeout=1)
+
+        # the socket is closed along with the event loop, if it was being
+        # served; close it here otherwise (closing twice is harmless)
         self.resultsSocket.close()
 
 
-def launchPynealSim(TR, host, resultsServerPort, keepAlive=False):
+def launchPynealSim(TR, host, resultsServerPort, keepAlive=False,
+                    extendedProtocol=False):
     """ Launch a Pyneal simulator
 
     This simulator will mimic Pyneal just enough to launch the simulated
@@ -217,20 +447,26 @@ def launchPynealSim(TR, host, resultsServerPort, keepAlive=False):
         useful to keep the server alive so that you may continually send
         requests, even after the end of the simulated "scan". In that case,
         set this flag to True
+    extendedProtocol : bool, optional
+        Flag for whether to support persistent connections and range requests
+        (default=False). Real Pyneal does NOT support these, so only use this
+        for clients that will never talk to Pyneal itself
 
     """
     # Results Server Thread, listens for requests from end-user (e.g. task
     # presentation), and sends back results
-    settings = {'pynealHost': host, 'resultsServerPort': resultsServerPort}
+    nVols = 500
+    settings = {'pynealHost': host, 'resultsServerPort': resultsServerPort,
+                'nVols': nVols, 'extendedProtocol': extendedProtocol}
     resultsServer = ResultsServer(settings)
     resultsServer.daemon = True
     resultsServer.start()
-    print('Starting Results Server...')
+    logger.info('Starting Results Server...')
 
-    # Start making up fake results
-    for volIdx in range(500):
-        # generate a random value
-        avgActivation = np.around(np.random.normal(loc=2400, scale=15), decimals=2)
+    # Start making up fake results. Generate all of the random values at once
+    fakeValues = np.around(np.random.default_rng().normal(loc=2400, scale=15, size=nVols), decimals=2)
+    for volIdx in range(nVols):
+        avgActivation = float(fakeValues[volIdx])
         result = {'average': avgActivation}
 
         # send result to the resultsServer
@@ -240,7 +476,7 @@ def launchPynealSim(TR, host, resultsServerPort, keepAlive=False):
         time.sleep(TR / 1000)
 
     if not keepAlive:
-        print('Shutting down simulated Results Server')
+        logger.info('Shutting down simulated Results Server')
         resultsServer.killServer()
 
 if __name__ == '__main__':
@@ -262,6 +498,14 @@ if __name__ == '__main__':
     parser.add_argument('--keepAlive',
                         default=False,
                         action='store_true')
+    parser.add_argument('--extendedProtocol',
+                        default=False,
+                        action='store_true',
+                        help='support persistent connections and range requests (not supported by real Pyneal)')
     args = parser.parse_args()
-    print(args.keepAlive)
-    launchPynealSim(args.TR, args.sockethost, args.socketport, keepAlive=args.keepAlive)
+
+    # show the startup/shutdown messages (use level=logging.DEBUG to also
+    # log every request)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    launchPynealSim(args.TR, args.sockethost, args.socketport, keepAlive=args.keepAlive,
+                    extendedProtocol=args.extendedProtocol)